@@ -1,10 +1,20 @@
 import pandas as pd
-import geopandas as gpd
-import plotly.express as px  
+import plotly.express as px
 import plotly.graph_objects as go
-from dash import Dash, Patch, dcc, html, Input, Output  # Dash > 2.9
+from dash import Dash, Patch, dcc, html, dash_table, Input, Output, State, ctx, no_update  # Dash > 2.9
+from dash.exceptions import PreventUpdate
+from flask import Response, request
+from urllib.parse import parse_qs
 import numpy as np
 import json
+import base64
+import os
+import sys
+import threading
+
+from result_cache import store_from_environment
+from tickets_dataset import TicketsDataset, MAP_LEVEL_MIN_ZOOM, map_level_for_zoom, normalize_date_range
+from dataset_registry import DatasetRegistry
 
 external_stylesheets = [
     "https://codepen.io/chriddyp/pen/bWLwgP.css",
@@ -15,6 +25,45 @@ external_stylesheets = [
 
 FIG_DISPLAY_CONFIG = {'displaylogo': False}
 INITIAL_VIOLATION_TYPE = 'Street cleaning'
+INITIAL_MAP_ZOOM = 9
+
+# milliseconds per month when playing the map animation
+ANIMATION_FRAME_INTERVAL = 400
+
+# optional tract -> neighborhood crosswalk (columns GEOID, neighborhood)
+# without it, neighborhoods fall back to groups of tracts sharing a GEOID prefix
+NEIGHBORHOOD_CROSSWALK_PATH = 'processed data/tract_neighborhood_crosswalk.csv'
+
+# optional finer-grained aggregate, by day and hour of day (columns GEOID, date, hour, category, tickets count)
+# enables the daily timeline and the weekday / hour of day breakdown
+FINE_TICKETS_PATH = 'processed data/tickets_by_tract_by_day_by_hour_by_category.csv'
+MONTHLY_TICKETS_PATH = 'processed data/tickets_by_tract_by_month_by_category.csv'
+
+# datasets the dashboard can show, picked with the dropdown or the url (`?dataset=<name>`)
+# (see tickets_dataset.py for the config keys; more can be added in a json file of the same shape at DATASETS_CONFIG)
+DATASETS = {
+    'nyc-parking-tickets': {
+        'title': 'NYC parking tickets',
+        'tracts': 'processed data/tracts_data.csv',
+        'geometry': 'processed data/tract geometry - simplified.json',
+        'monthly_tickets': MONTHLY_TICKETS_PATH,
+        'fine_tickets': FINE_TICKETS_PATH,
+        'neighborhood_crosswalk': NEIGHBORHOOD_CROSSWALK_PATH,
+        'initial_violation_type': INITIAL_VIOLATION_TYPE,
+        'center': {'lat': 40.7, 'lon': -74},
+    },
+}
+DEFAULT_DATASET = 'nyc-parking-tickets'
+
+DATASETS_CONFIG_PATH = os.getenv('DATASETS_CONFIG', 'processed data/datasets.json')
+if os.path.exists(DATASETS_CONFIG_PATH):
+    with open(DATASETS_CONFIG_PATH, 'r') as datasets_config_file:
+        DATASETS.update(json.load(datasets_config_file))
+
+# memory all loaded datasets may take together; past it, the least recently shown ones are dropped until needed again
+DATASET_MEMORY_BUDGET = int(os.getenv('DATASET_MEMORY_BUDGET_MB', 2048)) * 1024 * 1024
+
+INITIAL_MAP_LEVEL = map_level_for_zoom(INITIAL_MAP_ZOOM)
 
 # create app
 app = Dash(__name__, external_stylesheets=external_stylesheets)
@@ -24,181 +73,189 @@ print('initiate app')
 # to serve online
 server = app.server
 
-# ---------- read in data and create initial state
+# results shared by all workers and datasets (see result_cache.py for the backends)
+result_store = store_from_environment()
 
-#----- load data
+# warmed-up results are only invalidated by a new dataset version, so keep them for a long time
+WARM_UP_RESULT_TTL = 365 * 24 * 60 * 60
 
-tracts = pd.read_csv(
-    'processed data/tracts_data.csv',
-    dtype={'GEOID':'str'}
-).set_index('GEOID')
+NO_SELECTION_RACE_BARS_TITLE = 'Race and ethnicity citywide (select area on map to compare)'
 
-with open('processed data/tract geometry - simplified.json', 'r') as geojson_file:
-    tracts_geometry = json.load(geojson_file)
-# TODO read this geojson directly into the fontend, without passing it through this laoyout object. not simple to do, though.
+# ---------- initial figures for a dataset
+# built once when the dataset is loaded; the callbacks patch them from there
 
-tickets = (
-    pd.read_csv(
-        'processed data/tickets_by_tract_by_month_by_category.csv', 
-        parse_dates=['year-month'],
-        dtype={'GEOID':'str'}
-        )
-    .rename(columns={
-        'year-month':'Issue Date',
-        'category':'Violation Type'
-        })
-    .set_index(['GEOID','Issue Date','Violation Type'])
-    ['tickets count']
-    .sort_index()
-)
+def build_figures(dataset):
 
-violation_types = tickets.index.get_level_values('Violation Type').unique()
-
-#----- summarize initial data
-# sum by month for timeline
-total_tickets_by_month = (
-    tickets
-    .loc[:,:,INITIAL_VIOLATION_TYPE]
-    .groupby('Issue Date')
-    .sum()
-    .rolling(3,1,center=True).mean()
-    .reset_index()
-)
+    #----- summarize initial data
+    initial_violation = [dataset.initial_violation_type]
 
-# sum by tract for map
-total_tickets_by_tract = (
-    tickets
-    .loc[:,:,INITIAL_VIOLATION_TYPE]
-    .groupby('GEOID')
-    .sum()
-    .reindex_like(tracts)
-    .fillna(0)
-    .astype(int)
-    .reset_index()
-)
+    # sum by month for timeline
+    total_tickets_by_month = pd.DataFrame({
+        'Issue Date': dataset.months,
+        'tickets count': dataset.sum_tickets_by_month(None, initial_violation),
+    })
 
-# total race pcts for citywide bars
-total_race_pct = (
-    (
-        (tracts[['White','Black','Asian','Hispanic']].sum())
-        /
-        (tracts['Total population'].sum())
+    # sum by map unit at the initial zoom level for map
+    total_tickets_by_unit = dataset.sum_tickets_by_unit(
+        INITIAL_MAP_LEVEL,
+        dataset.selected_date_range(None),
+        initial_violation
     )
-    .rename('Citywide')
-    .to_frame()
-)
 
-# generate empty race columns
-no_selection_race_pct = pd.DataFrame(index=['White','Black','Asian','Hispanic'],columns=['Selected area'],data=[0,0,0,0])
+    # generate empty race columns
+    no_selection_race_pct = pd.DataFrame(index=['White','Black','Asian','Hispanic'],columns=['Selected area'],data=[0,0,0,0])
+
+    race_bars_data = dataset.total_race_pct.join(no_selection_race_pct)
+
+    race_bars_title = NO_SELECTION_RACE_BARS_TITLE
+
+    #----- initiate figures
+
+    # create and configure map fig
+    map_fig = px.choropleth_mapbox(
+        data_frame=total_tickets_by_unit, # can this be blank and filled by first fire of the callback?
+        color='tickets count',
+        geojson=dataset.geometry_by_level[INITIAL_MAP_LEVEL],
+        locations='GEOID',
+        featureidkey='properties.GEOID',
+        color_continuous_scale='burg',
+        mapbox_style='carto-positron',
+        hover_data={
+            'GEOID':False,
+            'tickets count':':.0f'
+        },
+        zoom=INITIAL_MAP_ZOOM,
+        center = dataset.center,
+    )
 
-race_bars_data = total_race_pct.join(no_selection_race_pct)
+    # customize legend
+    map_fig.update_layout(
+        coloraxis_colorbar=dict(
+            title="Tickets",
+            orientation='h',
+            xanchor='left',
+            x=0,
+            yanchor='bottom',
+            y=0,
+            lenmode="fraction",
+            len=0.5,
+            thicknessmode='fraction',
+            thickness=0.035,
+        ),
+        margin=dict(l=0, r=0, t=0, b=0),
+        # keep the user's zoom and pan when the map data is patched (until the dataset changes)
+        uirevision=dataset.name,
+    )
 
-NO_SELECTION_RACE_BARS_TITLE = 'Race and ethnicity citywide (select area on map to compare)'
-race_bars_title = NO_SELECTION_RACE_BARS_TITLE
-
-
-#----- initiate figures
-
-# create and configure map fig
-map_fig = px.choropleth_mapbox(
-    data_frame=total_tickets_by_tract, # can this be blank and filled by first fire of the callback?
-    color='tickets count',
-    geojson=tracts_geometry,
-    locations='GEOID',
-    featureidkey='properties.GEOID',
-    color_continuous_scale='burg',
-    mapbox_style='carto-positron',
-    hover_data={
-        'GEOID':False,
-        'tickets count':':.0f'
-    },
-    zoom=9, 
-    center = {"lat": 40.7, "lon": -74},
-)
+    # customize tract geometry shapes (hide border lines)
+    map_fig.update_traces(
+        marker_opacity=0.75,
+        marker_line=dict(
+            width=0,
+            color='rgba(255,255,255,0)'
+        )
+    )
 
-# customize legend
-map_fig.update_layout(
-    coloraxis_colorbar=dict(
-        title="Tickets",
-        orientation='h',
-        xanchor='left',
-        x=0,
-        yanchor='bottom',
-        y=0,
-        lenmode="fraction",
-        len=0.5,
-        thicknessmode='fraction',
-        thickness=0.035,
-    ),
-    margin=dict(l=0, r=0, t=0, b=0),
+    # create and configure timeline fig
+
+    timeline_fig = px.line(
+        total_tickets_by_month,
+        x='Issue Date',
+        y='tickets count',
+        title='',
+        height=350,
+        template='plotly_white',
+        hover_data={
+            'Issue Date':False,
+            'tickets count':'.0f'
+        }
+    )
 
-)
+    timeline_fig.update_traces(
+        hovertemplate=None
+    )
 
-# customize tract geometry shapes (hide border lines)
-map_fig.update_traces(
-    marker_opacity=0.75,
-    marker_line=dict(
-        width=0,
-        color='rgba(255,255,255,0)'
+    timeline_fig.update_layout(
+        xaxis=dict(
+            rangeselector=dict(
+                visible=True
+            ),
+            type="date"
+        ),
+        yaxis_title="Tickets",
+        showlegend=False,
+        margin=dict(l=20, r=20, t=40, b=10),
+        font_family="'Open Sans', Helvetica, Arial, sans-serif",
+        hovermode='x',
+        modebar_remove=['zoom_in', 'zoom_out','autoscale']
     )
-)
 
-# create and configure timeline fig
-
-timeline_fig = px.line(
-    total_tickets_by_month,
-    x='Issue Date',
-    y='tickets count',
-    title='',
-    height=350,
-    template='plotly_white',
-    hover_data={
-        'Issue Date':False,
-        'tickets count':'.0f'
-    }
-)
+    timeline_fig.update_xaxes(rangeslider_thickness = 0)
 
-timeline_fig.update_traces(
-    hovertemplate=None
-)
+    # create and configure weekday / hour of day breakdown fig (only with the finer aggregate)
+    if dataset.ticket_cube is not None:
 
-timeline_fig.update_layout(
-    xaxis=dict(
-        rangeselector=dict(
-            visible=True
-        ),
-        type="date"
-    ),
-    yaxis_title="Tickets",
-    showlegend=False,
-    margin=dict(l=20, r=20, t=40, b=10),
-    font_family="'Open Sans', Helvetica, Arial, sans-serif",
-    hovermode='x',
-    modebar_remove=['zoom_in', 'zoom_out','autoscale']
-)
+        time_breakdown_fig = px.bar(
+            dataset.time_breakdown(None, initial_violation, dataset.selected_date_range(None), 'weekday').reset_index(),
+            x='weekday',
+            y='tickets count',
+            title='By day of week',
+            height=250,
+            template='plotly_white'
+        )
 
-timeline_fig.update_xaxes(rangeslider_thickness = 0)
+        time_breakdown_fig.update_layout(
+            xaxis=dict(type='category'),
+            xaxis_title=None,
+            yaxis_title='Tickets',
+            margin=dict(l=20, r=20, t=40, b=10),
+            font_family="'Open Sans', Helvetica, Arial, sans-serif"
+        )
 
+    else:
+        time_breakdown_fig = {}
 
+    # create and configure race bars fig
 
-# create and configure race bars fig
+    race_bars_fig = px.bar(
+        race_bars_data,
+        barmode='group',
+        title=race_bars_title,
+        height=250,
+        template='plotly_white'
+    )
 
-race_bars_fig = px.bar(
-    race_bars_data,
-    barmode='group',
-    title=race_bars_title,
-    height=250,
-    template='plotly_white'
-)
+    race_bars_fig.update_layout(
+        margin=dict(l=20, r=20, t=100, b=10),
+        yaxis_title='Percent of population',
+        xaxis_title=None,
+        yaxis_tickformat='.0%',
+        legend_title='Area',
+        font_family="'Open Sans', Helvetica, Arial, sans-serif"
+    )
 
-race_bars_fig.update_layout(
-    margin=dict(l=20, r=20, t=100, b=10),
-    yaxis_title='Percent of population',
-    xaxis_title=None,
-    yaxis_tickformat='.0%',
-    legend_title='Area',
-    font_family="'Open Sans', Helvetica, Arial, sans-serif"
-)
+    return {
+        'map': map_fig,
+        'timeline': timeline_fig,
+        'time_breakdown': time_breakdown_fig,
+        'race_bars': race_bars_fig,
+    }
+
+# ---------- read in data and create initial state
+# each dataset is read and indexed the first time it's shown (see tickets_dataset.py), with its figures,
+# so configuring more datasets doesn't slow down starting up with the default one
+
+def load_dataset(name, config):
+    dataset = TicketsDataset(name, config, result_store)
+    dataset.figures = build_figures(dataset)
+    # the map figure holds its own copy of the shapes, so count the figures against the budget too
+    dataset.update_nbytes()
+    print(f"dataset '{name}' loaded ({dataset.nbytes / 1e6:.0f} MB)")
+    return dataset
+
+datasets = DatasetRegistry(DATASETS, load_dataset, DATASET_MEMORY_BUDGET)
+
+default_dataset = datasets.get(DEFAULT_DATASET)
 
 
 # ------------------------------------------------------------------------------
@@ -206,24 +263,40 @@ race_bars_fig.update_layout(
 
 app.layout = html.Div(id='app', children=[
 
+        # ?dataset=<name> picks the dataset shown
+        dcc.Location(id='url', refresh=False),
+
         html.H1("Explore tickets by type"),
 
         html.Div(id='selector_container', children=[
-        
+
+            # only shown when there's more than one dataset to pick from
+            html.Div(id='dataset_selector', style={} if len(DATASETS) > 1 else {'display': 'none'}, children=[
+
+                html.P('Select dataset:'),
+
+                dcc.Dropdown(
+                    id='dataset_selection',
+                    options=[{'label': config.get('title', name), 'value': name} for name, config in DATASETS.items()],
+                    value=DEFAULT_DATASET,
+                    clearable=False,
+                )
+            ]),
+
             html.P('Select violation types:'),
 
             dcc.Dropdown(
                 id='violation_type_selection',
-                options=violation_types,
+                options=default_dataset.violation_types,
                 multi=True,
-                value=[INITIAL_VIOLATION_TYPE],
+                value=[default_dataset.initial_violation_type],
             )
         ]),
 
         html.Div(id='components_container', children=[
 
             html.Div(id='map_container', children=[
-            
+
                 dcc.Loading(id='map_loading', type='default', children = [
 
                     # initiates title; first callback will overwrite this title
@@ -231,13 +304,61 @@ app.layout = html.Div(id='app', children=[
 
                     # container and configuration for map figure
                     dcc.Graph(
-                        id='map', 
-                        figure=map_fig,
+                        id='map',
+                        figure=default_dataset.figures['map'],
                         config=FIG_DISPLAY_CONFIG
                     ),
 
-                    html.P(children=[''], id='double_click')
-                ])
+                    html.P(children=[''], id='double_click'),
+
+                    # map level currently drawn, so zooming only redraws when the level changes
+                    dcc.Store(id='map_level', data=INITIAL_MAP_LEVEL),
+
+                    # tracts selected on the map or by radius, with the share of each tract inside the selection
+                    dcc.Store(id='area_selection')
+                ]),
+
+                # select tickets within a distance of a point (leave it empty to clear)
+                html.Div(id='radius_search', children=[
+                    html.P('Or select within a distance of a point:'),
+                    dcc.Input(id='radius_lat', type='number', placeholder='latitude'),
+                    dcc.Input(id='radius_lon', type='number', placeholder='longitude'),
+                    dcc.Input(id='radius_meters', type='number', placeholder='meters', value=500, min=1),
+                    html.Button('Select', id='radius_select', n_clicks=0)
+                ]),
+
+                # month-by-month animation of the map; frames are fetched once per selection and played in the browser
+                html.Div(id='animation_controls', children=[
+                    html.Button('Play months', id='animation_play', n_clicks=0),
+                    html.Span(children=[''], id='animation_month'),
+                    dcc.Interval(id='animation_interval', interval=ANIMATION_FRAME_INTERVAL, disabled=True),
+                    dcc.Store(id='animation_frames')
+                ]),
+
+                # worst tracts for the current selection
+                dcc.RadioItems(
+                    id='ranking_metric',
+                    options=['tickets', 'per resident'],
+                    value='tickets',
+                    inline=True
+                ),
+
+                dash_table.DataTable(
+                    id='ranking_table',
+                    columns=[
+                        {'name': 'Rank', 'id': 'rank'},
+                        {'name': 'Tract', 'id': 'area'},
+                        {'name': 'Tickets', 'id': 'tickets', 'type': 'numeric', 'format': {'specifier': ',d'}},
+                        {'name': 'Tickets per 1,000 residents', 'id': 'tickets per 1,000 residents', 'type': 'numeric'},
+                    ],
+                    data=default_dataset.rank_units(
+                        'tract',
+                        default_dataset.map_z_vector('tract', default_dataset.selected_date_range(None), [default_dataset.initial_violation_type]),
+                        'tickets'
+                    ),
+                    style_as_list_view=True,
+                    style_cell={'font-family': "'Open Sans', Helvetica, Arial, sans-serif"}
+                )
             ]),
 
             html.Div(id='timeline_and_bars_container', children=[
@@ -247,59 +368,156 @@ app.layout = html.Div(id='app', children=[
                     # container and configuration for timeline
                     dcc.Graph(
                         id='timeline',
-                        figure=timeline_fig,
+                        figure=default_dataset.figures['timeline'],
                         config=FIG_DISPLAY_CONFIG
                     ),
 
                     # container and configuration for race bars
                     dcc.Graph(
-                        id='race_bar_plot', 
-                        figure=race_bars_fig,
-                        config=FIG_DISPLAY_CONFIG 
+                        id='race_bar_plot',
+                        figure=default_dataset.figures['race_bars'],
+                        config=FIG_DISPLAY_CONFIG
                     )
+                ]),
+
+                # daily timeline and weekday / hour of day breakdown, when the finer aggregate is loaded
+                html.Div(id='fine_time_container', style={} if default_dataset.ticket_cube is not None else {'display': 'none'}, children=[
+
+                    dcc.RadioItems(
+                        id='timeline_resolution',
+                        options=['month', 'day'],
+                        value='month',
+                        inline=True
+                    ),
+
+                    dcc.RadioItems(
+                        id='time_breakdown_by',
+                        options=['weekday', 'hour of day'],
+                        value='weekday',
+                        inline=True
+                    ),
+
+                    dcc.Graph(
+                        id='time_breakdown',
+                        figure=default_dataset.figures['time_breakdown'],
+                        config=FIG_DISPLAY_CONFIG
+                    )
+                ]),
+
+                # download the rows behind the current map and timeline
+                # (posted as a form, since a large map selection doesn't fit in a url)
+                html.Form(id='export_form', action='/export', method='POST', target='_blank', children=[
+                    dcc.Input(id='export_selection', name='selection', type='hidden', value=''),
+                    html.Button('Download CSV', name='format', value='csv', type='submit'),
+                    html.Button('Download Parquet', name='format', value='parquet', type='submit'),
                 ])
 
-            ])  
+            ])
 
         ])
-        
+
     ])
 
+# the registry decides how long datasets stay loaded, so don't hold on to this one here
+del default_dataset
+
 # ------------------------------------------------------------------------------
 # callbacks
 # Connect the Plotly graphs with Dash Components
 
+def dataset_switched():
+    # whether the current callback was triggered by picking another dataset
+    return 'dataset_selection.value' in ctx.triggered_prop_ids
+
+# to keep the dataset dropdown and the url in step, either way
+@app.callback(
+    [Output(component_id='url', component_property='search'),
+     Output(component_id='dataset_selection', component_property='value')],
+    [Input(component_id='url', component_property='search'),
+     Input(component_id='dataset_selection', component_property='value')]
+)
+def sync_dataset_selection(url_search,dataset_name):
+
+    if ctx.triggered_id == 'dataset_selection':
+        return f'?dataset={dataset_name}', no_update
+
+    requested_dataset = parse_qs((url_search or '').lstrip('?')).get('dataset', [None])[0]
+    if requested_dataset not in DATASETS or requested_dataset == dataset_name:
+        raise PreventUpdate
+
+    return no_update, requested_dataset
+
+# to reset the selections when switching datasets
+@app.callback(
+    [Output(component_id='violation_type_selection', component_property='options'),
+     Output(component_id='violation_type_selection', component_property='value'),
+     Output(component_id='fine_time_container', component_property='style'),
+     Output(component_id='map', component_property='selectedData'),
+     Output(component_id='timeline', component_property='relayoutData'),
+     Output(component_id='map', component_property='relayoutData')],
+    Input(component_id='dataset_selection', component_property='value'),
+    prevent_initial_call=True
+)
+def switch_dataset(dataset_name):
+
+    print(f"called 'switch_dataset' with '{dataset_name}'")
+
+    dataset = datasets.get(dataset_name)
+
+    return (
+        dataset.violation_types,
+        [dataset.initial_violation_type],
+        {} if dataset.ticket_cube is not None else {'display': 'none'},
+        None,
+        None,
+        None
+    )
+
 # to update map on selection of timeline or violation type
 @app.callback(
     [Output(component_id='map_title', component_property='children'),
-     Output(component_id='map', component_property='figure'),],
+     Output(component_id='map', component_property='figure'),
+     Output(component_id='map_level', component_property='data'),
+     Output(component_id='ranking_table', component_property='data')],
     [Input(component_id='timeline',component_property='relayoutData'),
-    Input(component_id='violation_type_selection', component_property='value')],
+    Input(component_id='violation_type_selection', component_property='value'),
+    Input(component_id='map', component_property='relayoutData'),
+    Input(component_id='ranking_metric', component_property='value'),
+    Input(component_id='dataset_selection', component_property='value')],
+    State(component_id='map_level', component_property='data'),
     prevent_initial_call=True
 )
-def update_map(selected_timeline_area,selected_violation):
-    
+def update_map(selected_timeline_area,selected_violation,map_view,ranking_metric,dataset_name,current_map_level):
+
     # # log what it's doing
     # # (werkzeug might be more useful but here's a summary )
     print("called 'update_map'")
     print(f" with 'selected_violation' = {selected_violation}")
     # print(f" with 'selected_timeline_area' = {selected_timeline_area}")
 
-    # get time range from timeline, if the timeline has been selected
-    # (this selects highly granular timestamps; could make this quantum; and also slightly delay the action until mouseup)
-    if selected_timeline_area is None:
-        selected_timeline_area = dict()
-
-    if 'xaxis.range[0]' in selected_timeline_area:
-        selected_dates = [
-            selected_timeline_area['xaxis.range[0]'], 
-            selected_timeline_area['xaxis.range[1]']
-        ]
+    dataset = datasets.get(dataset_name)
+
+    # a new dataset starts from its initial view, whatever the map and timeline showed before
+    if dataset_switched():
+        map_level = INITIAL_MAP_LEVEL
+        selected_timeline_area = None
+
+    # choose the map level from the zoom, when the map has just been zoomed
+    # (otherwise keep the level drawn: the map's last relayoutData may be older than the map shown)
+    elif ctx.triggered_id == 'map' and map_view and 'mapbox.zoom' in map_view:
+        map_level = map_level_for_zoom(map_view['mapbox.zoom'])
     else:
-        selected_dates = [
-            tickets.index.get_level_values('Issue Date').min(),
-            tickets.index.get_level_values('Issue Date').max()
-            ]
+        map_level = current_map_level
+
+    # panning or zooming within the same level doesn't change anything on the map
+    if ctx.triggered_id == 'map' and map_level == current_map_level:
+        raise PreventUpdate
+
+    print(f" at map level '{map_level}'")
+
+    # get time range from timeline, if the timeline has been selected
+    # (snapped to whole months, so nearby drags share cached results; could also slightly delay the action until mouseup)
+    selected_dates = dataset.selected_date_range(selected_timeline_area)
 
     print(f" and 'selected_dates = {selected_dates}")
 
@@ -310,49 +528,118 @@ def update_map(selected_timeline_area,selected_violation):
 
     title = f'Ticket type: {display_violation} & Date range: {display_dates}'
 
-    # subset the data
-    selected_tickets = (
-        tickets
-        .loc[:,slice(*selected_dates),selected_violation]
-        .groupby('GEOID')
-        .sum()
-        .reindex_like(tracts)
-        .fillna(0)
-        .astype(int)
-        .reset_index()
-        .values
-    )
+    # subset the data (or reuse the result from any worker that already computed it)
+    selected_tickets = dataset.map_z_vector(map_level, selected_dates, selected_violation)
 
     # print(f" updated data: {selected_tickets[:3]}")
 
+    # rank tracts for the table, whatever level the map is drawn at
+    # (the same vector as the map when it shows tracts; cached and warmed up like it otherwise)
+    if map_level == 'tract':
+        tract_tickets = selected_tickets
+    else:
+        tract_tickets = dataset.map_z_vector('tract', selected_dates, selected_violation)
+    ranking_table_data = dataset.rank_units('tract', tract_tickets, ranking_metric)
+
+    # switching the ranking metric leaves the map, and its level, as they are
+    if ctx.triggered_id == 'ranking_metric':
+        return title, no_update, no_update, ranking_table_data
+
     # patch the updated data into the data field of the fig
     patched_map_fig = Patch()
-    patched_map_fig['data'][0]['locations'] = selected_tickets[:,0]
-    patched_map_fig['data'][0]['z'] = selected_tickets[:,1]
-    
-    return title, patched_map_fig
+    patched_map_fig['data'][0]['locations'] = dataset.units_by_level[map_level].values
+    patched_map_fig['data'][0]['z'] = selected_tickets
+
+    # only send the shapes when the level (or dataset) changes
+    if map_level != current_map_level or dataset_switched():
+        patched_map_fig['data'][0]['geojson'] = dataset.geometry_by_level[map_level]
+
+    # and recenter on the new dataset
+    if dataset_switched():
+        patched_map_fig['layout']['mapbox']['center'] = dataset.center
+        patched_map_fig['layout']['mapbox']['zoom'] = INITIAL_MAP_ZOOM
+        patched_map_fig['layout']['uirevision'] = dataset.name
+
+    return title, patched_map_fig, map_level, ranking_table_data
+
+# to turn a selection on the map, or a radius around a point, into weighted tracts
+# lasso and box selections are intersected with the tract shapes as drawn, so tracts on their edge count in part
+# (see spatial_index.py); clicked areas count whole
+@app.callback(
+    Output(component_id='area_selection', component_property='data'),
+    [Input(component_id='map', component_property='selectedData'),
+     Input(component_id='radius_select', component_property='n_clicks'),
+     Input(component_id='dataset_selection', component_property='value')],
+    [State(component_id='radius_lat', component_property='value'),
+     State(component_id='radius_lon', component_property='value'),
+     State(component_id='radius_meters', component_property='value')]
+)
+def update_area_selection(selected_map_area,radius_clicks,dataset_name,radius_lat,radius_lon,radius_meters):
+
+    dataset = datasets.get(dataset_name)
+
+    if ctx.triggered_id == 'radius_select':
+        if radius_lat is None or radius_lon is None or not radius_meters or radius_meters <= 0:
+            return None
+        tract_weights = dataset.tracts_within_radius(radius_lon, radius_lat, radius_meters)
+
+    elif dataset_switched() or not bool(selected_map_area):
+        return None
+
+    elif 'mapbox' in selected_map_area.get('lassoPoints', {}) and len(selected_map_area['lassoPoints']['mapbox']) >= 3:
+        tract_weights = dataset.tracts_within_polygon(selected_map_area['lassoPoints']['mapbox'])
+
+    elif 'mapbox' in selected_map_area.get('range', {}):
+        (x0, y0), (x1, y1) = selected_map_area['range']['mapbox']
+        tract_weights = dataset.tracts_within_polygon([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+
+    else:
+        # get GEOID value(s) from selected data dict passed back from map selection/click
+        # (neighborhoods and boroughs selected on a zoomed-out map are expanded to their tracts)
+        return {
+            'GEOIDs': dataset.expand_to_tracts([i['location'] for i in selected_map_area['points']]),
+            'weights': None,
+        }
+
+    print(f"called 'update_area_selection': {len(tract_weights)} tracts, {tract_weights.sum():.1f} tracts' worth of area")
+
+    return {
+        'GEOIDs': tract_weights.index.tolist(),
+        'weights': tract_weights.values.tolist(),
+    }
 
 # to update timeline and race bars on selection of map or violation type
 @app.callback(
     [Output(component_id='race_bar_plot', component_property='figure'),
      Output(component_id='timeline', component_property='figure'),
      Output(component_id='double_click',component_property='children')],
-    [Input(component_id='map', component_property='selectedData'),
+    [Input(component_id='area_selection', component_property='data'),
     #  Input(component_id='map',component_property='clickData'),
-     Input(component_id='violation_type_selection', component_property='value')]
+     Input(component_id='violation_type_selection', component_property='value'),
+     Input(component_id='timeline_resolution', component_property='value'),
+     Input(component_id='dataset_selection', component_property='value')]
 )
-def update_race_bars_and_timeline_from_map_selection(selected_map_area,selected_violation):
+def update_race_bars_and_timeline_from_map_selection(area_selection,selected_violation,timeline_resolution,dataset_name):
 
     print('called update_race_bars_and_timeline')
+
+    dataset = datasets.get(dataset_name)
+
+    # daily timelines need the finer aggregate, which not every dataset has
+    if timeline_resolution not in dataset.timeline_x:
+        timeline_resolution = 'month'
+
     # get the tracts that were selected on map
-    
+
     # clear selection
     selected_GEOIDs = False
+    selected_weights = None
     double_click_text = ''
 
-    # get GEOID value(s) from selected data dict passed back from map selection/click
-    if bool(selected_map_area):
-        selected_GEOIDs = [i['location'] for i in selected_map_area['points']]
+    # tracts (and how much of each) selected on the map or by radius
+    if bool(area_selection):
+        selected_GEOIDs = area_selection['GEOIDs']
+        selected_weights = area_selection['weights']
         double_click_text = 'Double-click map to remove selection'
 
     # elif clicked_tract:
@@ -360,20 +647,8 @@ def update_race_bars_and_timeline_from_map_selection(selected_map_area,selected_
 
     if selected_GEOIDs:
 
-        # subset tracts to selection
-        tracts_selected = tracts.loc[selected_GEOIDs]
-
-        # recompute race pcts for selected tracts
-        selection_race_pct = (
-            (
-                (tracts_selected[['White','Black','Asian','Hispanic']].sum())
-                /
-                (tracts_selected['Total population'].sum())
-            )
-            # .rename('Selected area')
-            # .to_frame()
-            .values
-        )
+        # recompute race pcts for selected tracts (residents of partly selected tracts count in part)
+        selection_race_pct = dataset.race_pct(selected_GEOIDs, selected_weights)
 
         race_bars_title = 'Race and ethnicity citywide and selected area'
 
@@ -383,17 +658,7 @@ def update_race_bars_and_timeline_from_map_selection(selected_map_area,selected_
         patched_race_bars['layout']['title']['text'] = 'Race and ethnicity citywide and selected area'
 
         # recompute timeline from selected area and selected type
-        selected_area_timeline_data = (
-            tickets
-            .loc[selected_GEOIDs,:,selected_violation]
-            .groupby('Issue Date')
-            .sum()
-            .rolling(3,1,center=True).mean()
-            .reindex(
-                timeline_fig['data'][0]['x']   # get the existing timeline x axis and reindex on this to align new y data with existing x ticks, because the filtered data can include months with no data
-            )
-            .values
-        )
+        selected_area_timeline_data = dataset.timeline_y_vector(selected_GEOIDs, selected_violation, timeline_resolution, weights=selected_weights)
 
         timeline_title = 'Selected area'
 
@@ -403,7 +668,7 @@ def update_race_bars_and_timeline_from_map_selection(selected_map_area,selected_
         patched_timeline = Patch()
         patched_timeline['data'][0]['y'] = selected_area_timeline_data
         patched_timeline['layout']['title'] = timeline_title
-    
+
     else:
 
         # patch zeros and title to race bars fig
@@ -412,17 +677,7 @@ def update_race_bars_and_timeline_from_map_selection(selected_map_area,selected_
         patched_race_bars['layout']['title']['text'] = NO_SELECTION_RACE_BARS_TITLE
 
         # compute timeline from all tracts
-        selected_area_timeline_data = (
-            tickets
-            .loc[:,:,selected_violation]
-            .groupby('Issue Date')
-            .sum()
-            .rolling(3,1,center=True).mean()
-            .reindex(
-                timeline_fig['data'][0]['x']   # get the existing timeline x axis and reindex on this to align new y data with existing x ticks, because the filtered data can include months with no data
-            )
-            .values
-        )
+        selected_area_timeline_data = dataset.timeline_y_vector(None, selected_violation, timeline_resolution)
 
         timeline_title = 'Total citywide'
 
@@ -433,16 +688,437 @@ def update_race_bars_and_timeline_from_map_selection(selected_map_area,selected_
         patched_timeline['data'][0]['y'] = selected_area_timeline_data
         patched_timeline['layout']['title'] = timeline_title
 
+    # switch the x axis too when the resolution or dataset changes
+    if ctx.triggered_id == 'timeline_resolution' or dataset_switched():
+        patched_timeline['data'][0]['x'] = dataset.timeline_x[timeline_resolution]
+
+    # and the citywide bars with the dataset
+    if dataset_switched():
+        patched_race_bars['data'][0]['y'] = dataset.total_race_pct['Citywide'].values
+
     return patched_race_bars, patched_timeline, double_click_text
 
+# to update the weekday / hour of day breakdown on selection of map, timeline or violation type
+@app.callback(
+    Output(component_id='time_breakdown', component_property='figure'),
+    [Input(component_id='area_selection', component_property='data'),
+     Input(component_id='violation_type_selection', component_property='value'),
+     Input(component_id='timeline',component_property='relayoutData'),
+     Input(component_id='time_breakdown_by', component_property='value'),
+     Input(component_id='dataset_selection', component_property='value')],
+    prevent_initial_call=True
+)
+def update_time_breakdown(area_selection,selected_violation,selected_timeline_area,breakdown_by,dataset_name):
+
+    dataset = datasets.get(dataset_name)
+
+    if dataset.ticket_cube is None:
+        raise PreventUpdate
+
+    print('called update_time_breakdown')
+
+    if bool(area_selection) and area_selection['GEOIDs']:
+        selected_GEOIDs = area_selection['GEOIDs']
+        selected_weights = area_selection['weights']
+    else:
+        selected_GEOIDs = None
+        selected_weights = None
+
+    breakdown = dataset.time_breakdown(
+        selected_GEOIDs,
+        selected_violation,
+        dataset.selected_date_range(selected_timeline_area),
+        breakdown_by,
+        weights=selected_weights
+    )
+
+    # a new dataset gets its whole figure (the one shown may be the empty placeholder of a dataset without one),
+    # filled in the same way as the patch
+    if dataset_switched():
+        patched_time_breakdown = go.Figure(dataset.figures['time_breakdown'])
+    else:
+        patched_time_breakdown = Patch()
+    patched_time_breakdown['data'][0]['x'] = breakdown.index.values
+    patched_time_breakdown['data'][0]['y'] = breakdown.values
+    patched_time_breakdown['layout']['title']['text'] = 'By day of week' if breakdown_by == 'weekday' else 'By hour of day'
+
+    return patched_time_breakdown
+
+
+# to fetch all the animation frames for the selected violation types when playing starts
+# (and once more if the violation types, map level or dataset change while playing)
+@app.callback(
+    Output(component_id='animation_frames', component_property='data'),
+    [Input(component_id='animation_interval', component_property='disabled'),
+     Input(component_id='violation_type_selection', component_property='value'),
+     Input(component_id='map_level', component_property='data')],
+    State(component_id='dataset_selection', component_property='value'),
+    prevent_initial_call=True
+)
+def update_animation_frames(animation_stopped,selected_violation,map_level,dataset_name):
+
+    if animation_stopped:
+        raise PreventUpdate
+
+    print(f"called 'update_animation_frames' with {selected_violation} at map level '{map_level}'")
+
+    dataset = datasets.get(dataset_name)
+
+    frames = dataset.result_cache.get_array(
+        'animation',
+        [map_level, sorted(selected_violation)],
+        lambda: dataset.monthly_frames(map_level, selected_violation)
+    )
+
+    # packed little-endian unsigned ints, in the smallest size that fits, read in the browser as a typed array
+    frames_dtype = next(dtype for dtype in ['<u1', '<u2', '<u4'] if frames.max(initial=0) <= np.iinfo(dtype).max)
+
+    return {
+        'months': [month.strftime(r'%b %Y') for month in dataset.months],
+        'units': len(dataset.units_by_level[map_level]),
+        'dtype': np.dtype(frames_dtype).name,
+        'max': int(frames.max(initial=0)),
+        'frames': base64.b64encode(frames.astype(frames_dtype).tobytes()).decode(),
+    }
+
+# to start and stop the animation; stopping puts the map back to the selected date range
+app.clientside_callback(
+    """
+    function(n_clicks, map_figure) {
+        var playing = n_clicks % 2 === 1;
+        if (!playing) {
+            var graph = document.querySelector('#map .js-plotly-plot');
+            Plotly.restyle(graph, {z: [map_figure.data[0].z]}, [0]);
+            Plotly.relayout(graph, {'coloraxis.cauto': true});
+        }
+        return [!playing, playing ? 'Stop' : 'Play months', 0, ''];
+    }
+    """,
+    [Output(component_id='animation_interval', component_property='disabled'),
+     Output(component_id='animation_play', component_property='children'),
+     Output(component_id='animation_interval', component_property='n_intervals'),
+     Output(component_id='animation_month', component_property='children')],
+    Input(component_id='animation_play', component_property='n_clicks'),
+    State(component_id='map', component_property='figure'),
+    prevent_initial_call=True
+)
+
+# to step the map through the frames in the browser, without calling the server
+app.clientside_callback(
+    """
+    function(n_intervals, frames, animation_stopped) {
+        if (!frames || animation_stopped) {
+            return window.dash_clientside.no_update;
+        }
+        var graph = document.querySelector('#map .js-plotly-plot');
+
+        // decode each batch of frames once, and fix the color scale across all its months
+        if (window.animationFrames !== frames) {
+            var bytes = Uint8Array.from(atob(frames.frames), function(c) { return c.charCodeAt(0); });
+            var arrayTypes = {uint8: Uint8Array, uint16: Uint16Array, uint32: Uint32Array};
+            window.animationFrames = frames;
+            window.animationValues = new arrayTypes[frames.dtype](bytes.buffer);
+            Plotly.relayout(graph, {'coloraxis.cmin': 0, 'coloraxis.cmax': frames.max});
+        }
+
+        var month = n_intervals % frames.months.length;
+        var frame = window.animationValues.subarray(month * frames.units, (month + 1) * frames.units);
+        Plotly.restyle(graph, {z: [Array.from(frame)]}, [0]);
+
+        return frames.months[month];
+    }
+    """,
+    Output(component_id='animation_month', component_property='children', allow_duplicate=True),
+    Input(component_id='animation_interval', component_property='n_intervals'),
+    [State(component_id='animation_frames', component_property='data'),
+     State(component_id='animation_interval', component_property='disabled')],
+    prevent_initial_call=True
+)
+
+
+# to keep the export form in step with the selection on the map, timeline and dropdowns
+@app.callback(
+    Output(component_id='export_selection', component_property='value'),
+    [Input(component_id='timeline',component_property='relayoutData'),
+     Input(component_id='violation_type_selection', component_property='value'),
+     Input(component_id='area_selection', component_property='data'),
+     Input(component_id='dataset_selection', component_property='value')]
+)
+def update_export_selection(selected_timeline_area,selected_violation,area_selection,dataset_name):
+
+    selected_dates = datasets.get(dataset_name).selected_date_range(selected_timeline_area)
+
+    # the same tracts (and weights, for a lasso, box or radius) as the timeline and race bars
+    if bool(area_selection) and area_selection['GEOIDs']:
+        selected_GEOIDs = area_selection['GEOIDs']
+        selected_weights = area_selection['weights']
+    else:
+        selected_GEOIDs = None
+        selected_weights = None
+
+    return json.dumps({
+        'dataset': dataset_name,
+        'violation_types': selected_violation,
+        'dates': [date.strftime('%Y-%m-%d') for date in selected_dates],
+        'tracts': selected_GEOIDs,
+        'weights': selected_weights,
+    })
+
+# ------------------------------------------------------------------------------
+# export
+# streams the tract x month x category rows for a selection, a chunk of the aggregate at a time
+# (see TicketsDataset.export_chunks), so exporting the whole history never holds a second copy of it in memory
+
+EXPORT_COLUMNS = ['GEOID', 'year-month', 'category', 'tickets count']
+# added for weighted selections: the share of each row's tract inside the selection
+# (the counts stay whole, so the weights can be applied or not)
+EXPORT_WEIGHT_COLUMN = 'weight'
+
+def export_csv(chunks, columns):
+    yield ','.join(columns) + '\n'
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False, date_format='%Y-%m')
+
+# file-like sink for the parquet writer that hands back what was written since the last take()
+class StreamedBytes:
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_parquet(chunks, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    column_types = {
+        'GEOID': pa.string(),
+        'year-month': pa.timestamp('ms'),
+        'category': pa.string(),
+        'tickets count': pa.int64(),
+        EXPORT_WEIGHT_COLUMN: pa.float64(),
+    }
+    schema = pa.schema([(column, column_types[column]) for column in columns])
+
+    # one row group per chunk, sent as soon as it's written
+    sink = StreamedBytes()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in chunks:
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False, safe=False))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'parquet': (export_parquet, 'application/vnd.apache.parquet'),
+}
+
+def is_list_of_strings(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+# takes the same selection as the export form (json in 'selection'), by GET or POST:
+# tracts (with optional weights) as selected in the app, or map areas of any level
+@server.route('/export', methods=['GET', 'POST'])
+def export():
+    export_format = request.values.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return f'unknown format {export_format!r}', 400
+
+    try:
+        selection = json.loads(request.values.get('selection') or '{}')
+    except ValueError:
+        return 'selection is not valid json', 400
+    if not isinstance(selection, dict):
+        return 'selection should be a json object', 400
+
+    dataset_name = selection.get('dataset') or DEFAULT_DATASET
+    if dataset_name not in DATASETS:
+        return f'unknown dataset {dataset_name!r}', 400
+    dataset = datasets.get(dataset_name)
+
+    if selection.get('violation_types') and not is_list_of_strings(selection['violation_types']):
+        return 'violation_types should be a list of violation types', 400
+    selected_violation = selection.get('violation_types') or list(dataset.violation_types)
+
+    if selection.get('dates'):
+        if not is_list_of_strings(selection['dates']) or len(selection['dates']) != 2:
+            return 'dates should be a list of a start and an end date', 400
+        try:
+            selected_dates = normalize_date_range(*selection['dates'])
+        except ValueError:
+            return f"dates {selection['dates']!r} are not valid dates", 400
+    else:
+        selected_dates = dataset.selected_date_range(None)
+
+    if selection.get('areas') and not is_list_of_strings(selection['areas']):
+        return 'areas should be a list of map areas', 400
+    if selection.get('tracts') and not is_list_of_strings(selection['tracts']):
+        return 'tracts should be a list of GEOIDs', 400
+    selected_weights = selection.get('weights') if selection.get('tracts') else None
+    if selected_weights is not None and (
+        not isinstance(selected_weights, list)
+        or len(selected_weights) != len(selection['tracts'])
+        or not all(isinstance(weight, (int, float)) for weight in selected_weights)
+    ):
+        return 'weights should be a list of numbers, one per tract', 400
+    if selection.get('tracts') and len(set(selection['tracts'])) != len(selection['tracts']):
+        return 'tracts should not repeat a GEOID', 400
+
+    if selection.get('tracts'):
+        selected_GEOIDs = selection['tracts']
+    elif selection.get('areas'):
+        selected_GEOIDs = dataset.expand_to_tracts(selection['areas'])
+    else:
+        selected_GEOIDs = None
+
+    print(f"called 'export' of '{dataset_name}' as {export_format} with {selected_violation}, {selected_dates}")
+
+    columns = EXPORT_COLUMNS + ([EXPORT_WEIGHT_COLUMN] if selected_weights is not None else [])
+
+    write_rows, mimetype = EXPORT_FORMATS[export_format]
+    return Response(
+        write_rows(dataset.export_chunks(selected_dates, selected_violation, selected_GEOIDs, selected_weights), columns),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={dataset_name}.{export_format}'}
+    )
 
 # ------------------------------------------------------------------------------
+# spatial query
+# tracts within a radius of a point (?lat=&lon=&radius= in metres) or inside a polygon
+# (posted as json: {"polygon": geojson geometry or [[lon, lat], ...]}), each with the share of its area inside,
+# as used for the timeline and race bars of a lasso or radius selection
+
+@server.route('/spatial-query', methods=['GET', 'POST'])
+def spatial_query():
+    query = request.get_json(silent=True) or request.values
+
+    dataset_name = query.get('dataset') or DEFAULT_DATASET
+    if dataset_name not in DATASETS:
+        return f'unknown dataset {dataset_name!r}', 400
+    dataset = datasets.get(dataset_name)
+
+    try:
+        if query.get('polygon'):
+            tract_weights = dataset.tracts_within_polygon(query['polygon'])
+        else:
+            tract_weights = dataset.tracts_within_radius(float(query['lon']), float(query['lat']), float(query['radius']))
+    except (KeyError, TypeError, ValueError) as error:
+        return f'expected lat, lon and radius, or a polygon ({error})', 400
+
+    return {'dataset': dataset_name, 'tracts': tract_weights.round(4).to_dict()}
 
-# this serves locally 
+# ------------------------------------------------------------------------------
+# warm-up
+# precompute the most common states (the initial view and each single violation type, full date range)
+# into the result cache, so the first users after a deploy don't pay for them
+
+# so each worker runs at most one warm-up at a time
+warm_up_lock = threading.Lock()
+
+def warm_result_cache(dataset):
+    print(f"warming up result cache for dataset '{dataset.name}'")
+
+    full_date_range = dataset.selected_date_range(None)
+
+    for violation_type in dataset.violation_types:
+        for map_level in MAP_LEVEL_MIN_ZOOM:
+            dataset.map_z_vector(map_level, full_date_range, [violation_type], ttl=WARM_UP_RESULT_TTL)
+        dataset.timeline_y_vector(None, [violation_type], ttl=WARM_UP_RESULT_TTL)
+
+    # shared with every worker, for /ready
+    dataset.result_cache.mark_warm(ttl=WARM_UP_RESULT_TTL)
+    print(f"result cache warm for dataset '{dataset.name}' version {dataset.version}")
+
+def warm_default_dataset():
+    if not warm_up_lock.acquire(blocking=False):
+        return
+    try:
+        dataset = datasets.get(DEFAULT_DATASET)
+        if not dataset.result_cache.is_warm():
+            warm_result_cache(dataset)
+    finally:
+        warm_up_lock.release()
+
+def start_warm_up():
+    # runs alongside the server; /ready reports when it's done
+    # (skipped if the build or another worker already warmed the shared store for this dataset version;
+    # other datasets warm up as they're first shown)
+    if os.getenv('WARM_UP_ON_START', '1') == '1':
+        threading.Thread(target=warm_default_dataset, daemon=True).start()
+
+# readiness check for the orchestrator: only route traffic here once warm
+# (read from the shared store, so every worker answers for the whole deployment, not just itself)
+@server.route('/ready')
+def ready():
+    if os.getenv('WARM_UP_ON_START', '1') != '1' or datasets.get(DEFAULT_DATASET).result_cache.is_warm():
+        return 'ready', 200
+    # warm up again if the mark was evicted from the store since (does nothing while a warm-up is running)
+    start_warm_up()
+    return 'warming up', 503
+
+# ------------------------------------------------------------------------------
+# memory report
+# sizes of the main in-memory structures of each dataset, to see what fits in the container and the budget
+# (`python dash-example-app-rebuild.py memory`)
+
+def memory_report(dataset):
+    print(f"\ndataset '{dataset.name}'")
+
+    total = 0
+    print(f"{'structure':<45}{'MB':>10}")
+    for name, size in dataset.memory_sizes().items():
+        total += size
+        print(f'{name:<45}{size / 1e6:>10.2f}')
+    print(f"{'total':<45}{total / 1e6:>10.2f}")
+
+    tickets = dataset.tickets
+    print(f'\ntickets: {len(tickets)} rows, counts as {tickets.dtype}, index codes as {[str(codes.dtype) for codes in tickets.index.codes]}')
+
+# ------------------------------------------------------------------------------
+
+# served by gunicorn
+if __name__ != '__main__':
+    start_warm_up()
+
+# this serves locally
+# (or `python dash-example-app-rebuild.py warm` just warms the result cache for every dataset, e.g. during the docker build,
+# and `python dash-example-app-rebuild.py memory` prints the memory report for every dataset)
 
 if __name__ == '__main__':
 
-    import os
+    if sys.argv[1:] == ['warm']:
+        for dataset_name in datasets.names():
+            warm_result_cache(datasets.get(dataset_name))
+        sys.exit()
+
+    if sys.argv[1:] == ['memory']:
+        print(f'memory budget for loaded datasets: {DATASET_MEMORY_BUDGET / 1e6:.0f} MB')
+        for dataset_name in datasets.names():
+            memory_report(datasets.get(dataset_name))
+        sys.exit()
+
+    start_warm_up()
+
     from werkzeug.middleware.profiler import ProfilerMiddleware
 
     PROF_DIR = 'profiles'
@@ -450,8 +1126,8 @@ if __name__ == '__main__':
     if os.getenv("PROFILER", None):
         app.server.config["PROFILE"] = True
         app.server.wsgi_app = ProfilerMiddleware(
-            app.server.wsgi_app, 
-            sort_by=["cumtime"], 
+            app.server.wsgi_app,
+            sort_by=["cumtime"],
             restrictions=[50],
             stream=None,
             profile_dir=PROF_DIR
@@ -0,0 +1,60 @@
+# datasets served by one deployment, each loaded on first use and kept while it fits in a shared memory budget
+# (least recently used datasets are dropped first; they're loaded again if asked for later)
+
+import threading
+from collections import OrderedDict
+
+
+class DatasetRegistry:
+
+    def __init__(self, configs, load, memory_budget):
+        # configs: name -> config dict; load(name, config) builds a dataset with an `nbytes` attribute
+        self.configs = configs
+        self._load = load
+        self.memory_budget = memory_budget
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per dataset, so loading one dataset doesn't hold up requests for the others
+        self._loading_locks = {name: threading.Lock() for name in configs}
+
+    def names(self):
+        return list(self.configs)
+
+    def _get_loaded(self, name):
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+        return None
+
+    def get(self, name):
+        if name not in self.configs:
+            raise KeyError(f'unknown dataset {name!r}')
+
+        dataset = self._get_loaded(name)
+        if dataset is not None:
+            return dataset
+
+        with self._loading_locks[name]:
+            # another thread may have loaded it while this one waited
+            dataset = self._get_loaded(name)
+            if dataset is not None:
+                return dataset
+
+            print(f'loading dataset {name!r}')
+            dataset = self._load(name, self.configs[name])
+
+            with self._lock:
+                self._loaded[name] = dataset
+                self._evict(keep=name)
+
+        return dataset
+
+    def _evict(self, keep):
+        # drop the least recently used datasets until the rest fit the budget (always keeping the one just loaded)
+        while sum(dataset.nbytes for dataset in self._loaded.values()) > self.memory_budget:
+            oldest = next(iter(self._loaded))
+            if oldest == keep:
+                break
+            print(f'dropping dataset {oldest!r} to stay within the memory budget')
+            del self._loaded[oldest]
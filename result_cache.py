@@ -0,0 +1,215 @@
+# shared cache for callback results, so gunicorn workers don't each recompute the same map and timeline
+# values are numpy arrays stored as compact .npy bytes; keys are hashed and include the dataset version
+#
+# the store is picked from the environment:
+#   RESULT_CACHE_URL=redis://host:6379/0  -> redis (or anything speaking the protocol; needs `pip install redis`)
+#   otherwise                             -> sqlite file shared by all workers on the host,
+#                                            in RESULT_CACHE_DIR (default /dev/shm, i.e. shared memory, if it exists)
+
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# cache hits record their last use in memory, and write them out together every this many hits or seconds
+# (a write per hit would queue every worker on sqlite's single writer lock)
+TOUCH_BATCH_SIZE = 100
+TOUCH_FLUSH_SECONDS = 30
+
+
+def encode_array(array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_array(value):
+    return np.load(io.BytesIO(value), allow_pickle=False)
+
+
+def make_key(dataset_version, name, key_parts):
+    # hash the (json-able) parts so any selection makes a short fixed-length key
+    digest = hashlib.sha1(
+        json.dumps(key_parts, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f'{dataset_version}:{name}:{digest}'
+
+
+# local store: one sqlite table shared across processes, evicting the least recently used rows past max_bytes
+# (the table's total size is kept up to date by triggers, so checking it doesn't scan the table)
+class SQLiteResultStore:
+
+    def __init__(self, path, ttl=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # one connection per process and thread (sqlite connections can't be shared between threads);
+        # gunicorn forks after import, so open lazily
+        self._local = threading.local()
+        # last use of keys hit since the last flush, shared by the threads of this process
+        self._touched = {}
+        self._touched_pid = os.getpid()
+        self._touched_lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def _connect(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, last_used REAL);'
+                'CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);'
+                'CREATE INDEX IF NOT EXISTS results_expires ON results (expires);'
+                'CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER);'
+                'INSERT OR IGNORE INTO totals SELECT 0, COALESCE(SUM(size), 0) FROM results;'
+                'CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results'
+                ' BEGIN UPDATE totals SET bytes = bytes + NEW.size; END;'
+                'CREATE TRIGGER IF NOT EXISTS results_update AFTER UPDATE OF size ON results'
+                ' BEGIN UPDATE totals SET bytes = bytes + NEW.size - OLD.size; END;'
+                'CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results'
+                ' BEGIN UPDATE totals SET bytes = bytes - OLD.size; END;'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key):
+        connection = self._connect()
+        now = time.time()
+        row = connection.execute(
+            'SELECT value FROM results WHERE key = ? AND expires > ?', (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        self._touch(key, now)
+        return row[0]
+
+    def _touch(self, key, now):
+        with self._touched_lock:
+            # touches recorded before a fork belong to the parent
+            if self._touched_pid != os.getpid():
+                self._touched = {}
+                self._touched_pid = os.getpid()
+            self._touched[key] = now
+            due = len(self._touched) >= TOUCH_BATCH_SIZE or now - self._last_flush >= TOUCH_FLUSH_SECONDS
+        if due:
+            self.flush_touches()
+
+    def flush_touches(self):
+        # write the recorded last uses in one transaction
+        with self._touched_lock:
+            touched, self._touched = self._touched, {}
+            self._last_flush = time.time()
+        if not touched:
+            return
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN')
+            connection.executemany(
+                'UPDATE results SET last_used = ? WHERE key = ?',
+                [(last_used, key) for key, last_used in touched.items()]
+            )
+
+    def total_bytes(self):
+        return self._connect().execute('SELECT bytes FROM totals').fetchone()[0]
+
+    def set(self, key, value, ttl=None):
+        connection = self._connect()
+        now = time.time()
+        connection.execute(
+            'INSERT INTO results VALUES (?, ?, ?, ?, ?)'
+            ' ON CONFLICT (key) DO UPDATE SET'
+            ' value = excluded.value, size = excluded.size, expires = excluded.expires, last_used = excluded.last_used',
+            (key, value, len(value), now + (ttl or self.ttl), now)
+        )
+        self._evict(now)
+
+    def _evict(self, now):
+        connection = self._connect()
+        connection.execute('DELETE FROM results WHERE expires <= ?', (now,))
+        total_bytes = self.total_bytes()
+        if total_bytes <= self.max_bytes:
+            return
+        # recent hits count as recent uses
+        self.flush_touches()
+        # drop the least recently used rows until back under the limit
+        excess = total_bytes - self.max_bytes
+        freed = 0
+        stale_keys = []
+        for key, size in connection.execute('SELECT key, size FROM results ORDER BY last_used'):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        connection.executemany('DELETE FROM results WHERE key = ?', stale_keys)
+
+
+# redis store: expiry is set per key; size-bounded eviction is left to the server's maxmemory policy
+# (run it with `maxmemory-policy allkeys-lru`)
+# takes any client with redis-py's get/set, so a local stand-in works too
+class RedisResultStore:
+
+    def __init__(self, client, ttl=DEFAULT_TTL_SECONDS):
+        self.client = client
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url, ttl=DEFAULT_TTL_SECONDS):
+        import redis  # optional dependency, only needed for this backend
+        return cls(redis.Redis.from_url(url), ttl=ttl)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl or self.ttl)
+
+
+def store_from_environment():
+    ttl = int(os.getenv('RESULT_CACHE_TTL', DEFAULT_TTL_SECONDS))
+
+    if os.getenv('RESULT_CACHE_URL'):
+        return RedisResultStore.from_url(os.getenv('RESULT_CACHE_URL'), ttl=ttl)
+
+    default_directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return SQLiteResultStore(
+        os.path.join(os.getenv('RESULT_CACHE_DIR', default_directory), 'parking-tickets-results.sqlite'),
+        ttl=ttl,
+        max_bytes=int(os.getenv('RESULT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+    )
+
+
+# wraps a store with the dataset version so stale results from an older dataset are never read
+class ResultCache:
+
+    def __init__(self, store, dataset_version):
+        self.store = store
+        self.dataset_version = dataset_version
+
+    # ttl overrides the store's default, e.g. to keep warmed-up results for longer
+    def get_array(self, name, key_parts, compute, ttl=None):
+        key = make_key(self.dataset_version, name, key_parts)
+        value = self.store.get(key)
+        if value is not None:
+            return decode_array(value)
+        array = np.asarray(compute())
+        self.store.set(key, encode_array(array), ttl=ttl)
+        return array
+
+    # whether the warm-up has finished for this dataset version, in any worker or in the build,
+    # recorded in the store itself so every worker reads the same answer
+    def mark_warm(self, ttl=None):
+        self.store.set(f'{self.dataset_version}:warm', b'1', ttl=ttl)
+
+    def is_warm(self):
+        return self.store.get(f'{self.dataset_version}:warm') is not None
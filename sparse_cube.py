@@ -0,0 +1,181 @@
+# tickets by tract x day x hour x category, keeping only the non-zero cells
+# (a dense array of that shape would be far too big to keep in memory)
+#
+# cells are stored CSR-style: sorted by tract, with cells tract_pointers[i]:tract_pointers[i+1] belonging to tract i,
+# and one small-int column per key, so memory is proportional to the number of non-zero cells
+
+import numpy as np
+import pandas as pd
+
+# 1970-01-01, day 0, was a Thursday
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+EPOCH_WEEKDAY = 3
+
+
+def months_since_epoch(days):
+    return np.asarray(days).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+class SparseTicketCube:
+
+    def __init__(self, GEOIDs, categories, tract_pointers, day, hour, category, count):
+        self.GEOIDs = GEOIDs                # pd.Index of tracts, by position
+        self.categories = categories        # pd.Index of violation types, by code
+        self.tract_pointers = tract_pointers
+        self.day = day                      # days since 1970-01-01
+        self.hour = hour
+        self.category = category
+        self.count = count
+
+    # from rows of GEOID, date, hour, category, tickets count (e.g. the fine-grained csv)
+    @classmethod
+    def from_frame(cls, frame):
+        GEOID_codes, GEOIDs = pd.factorize(frame['GEOID'], sort=True)
+        category_codes, categories = pd.factorize(frame['category'], sort=True)
+        day = (
+            pd.to_datetime(frame['date']).values.astype('datetime64[D]').astype(np.int64)
+        )
+
+        # sum duplicate cells, then sort by tract so each tract's cells are contiguous
+        cells = (
+            pd.DataFrame({
+                'tract': GEOID_codes.astype(np.int32),
+                'day': day.astype(np.int32),
+                'hour': frame['hour'].values.astype(np.int8),
+                'category': category_codes.astype(np.int16),
+                'count': frame['tickets count'].values,
+            })
+            .groupby(['tract', 'day', 'hour', 'category'], sort=True)
+            ['count']
+            .sum()
+        )
+        cells = cells[cells > 0]
+
+        tract = cells.index.get_level_values('tract').values
+        tract_pointers = np.searchsorted(tract, np.arange(len(GEOIDs) + 1)).astype(np.int64)
+
+        return cls(
+            pd.Index(GEOIDs, name='GEOID'),
+            pd.Index(categories, name='Violation Type'),
+            tract_pointers,
+            cells.index.get_level_values('day').values.astype(np.int32),
+            cells.index.get_level_values('hour').values.astype(np.int8),
+            cells.index.get_level_values('category').values.astype(np.int16),
+            cells.values.astype(np.min_scalar_type(cells.max() if len(cells) else 0)),
+        )
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls.from_frame(
+            pd.read_csv(path, dtype={'GEOID': 'str', 'category': 'str'})
+        )
+
+    @property
+    def nbytes(self):
+        return sum(
+            array.nbytes
+            for array in [self.tract_pointers, self.day, self.hour, self.category, self.count]
+        )
+
+    def __len__(self):
+        return len(self.count)
+
+    def _select(self, GEOIDs=None, categories=None, dates=None, weights=None):
+        # positions of the cells in the selected tracts, categories and (inclusive) date range,
+        # and each cell's tract weight if weights (one per GEOID) are given
+        cell_weights = None
+        if GEOIDs is None:
+            cells = np.arange(len(self))
+        else:
+            positions = self.GEOIDs.get_indexer(GEOIDs)
+            found = positions >= 0
+            positions = positions[found]
+            # concatenate each tract's run of cells without a python loop
+            starts = self.tract_pointers[positions]
+            lengths = self.tract_pointers[positions + 1] - starts
+            run_offsets = np.cumsum(lengths) - lengths
+            cells = np.repeat(starts - run_offsets, lengths) + np.arange(lengths.sum())
+            if weights is not None:
+                cell_weights = np.repeat(np.asarray(weights, dtype=np.float64)[found], lengths)
+
+        keep = np.ones(len(cells), dtype=bool)
+        if categories is not None:
+            wanted_categories = self.categories.isin(categories)
+            keep &= wanted_categories[self.category[cells]]
+        if dates is not None:
+            first_day, last_day = [
+                pd.Timestamp(date).to_datetime64().astype('datetime64[D]').astype(np.int64)
+                for date in dates
+            ]
+            keep &= (self.day[cells] >= first_day) & (self.day[cells] <= last_day)
+        return cells[keep], None if cell_weights is None else cell_weights[keep]
+
+    # tickets summed by 'day', 'month', 'weekday' or 'hour' for a selection, as a Series with every slot filled
+    # (with weights, one per GEOID, each tract's tickets count by its weight)
+    def rollup(self, by, GEOIDs=None, categories=None, dates=None, weights=None):
+        cells, cell_weights = self._select(GEOIDs, categories, dates, weights)
+        count = self.count[cells].astype(np.int64)
+        if cell_weights is not None:
+            count = count * cell_weights
+        day = self.day[cells]
+
+        if by == 'hour':
+            return pd.Series(
+                np.bincount(self.hour[cells], weights=count, minlength=24),
+                index=pd.RangeIndex(24, name='hour'),
+                name='tickets count'
+            )
+
+        if by == 'weekday':
+            return pd.Series(
+                np.bincount((day + EPOCH_WEEKDAY) % 7, weights=count, minlength=7),
+                index=pd.Index(WEEKDAY_NAMES, name='weekday'),
+                name='tickets count'
+            )
+
+        if by in ('day', 'month'):
+            # every slot across the whole cube, so different selections line up on the same axis
+            if by == 'day':
+                first, last = self.day.min(), self.day.max()
+                slots = day - first
+                unit = 'datetime64[D]'
+            else:
+                first, last = months_since_epoch([self.day.min(), self.day.max()])
+                slots = months_since_epoch(day) - first
+                unit = 'datetime64[M]'
+            index = pd.DatetimeIndex(np.arange(first, last + 1).astype(unit), name='Issue Date')
+            return pd.Series(
+                np.bincount(slots, weights=count, minlength=len(index)),
+                index=index,
+                name='tickets count'
+            )
+
+        raise ValueError(f'unknown rollup {by!r}')
+
+    # the monthly tract x month x category aggregate the dashboard callbacks use, rolled up from the cells
+    # (summed on integer codes, with the index built from them, so no per-row strings are made)
+    def to_monthly_series(self):
+        tract = np.repeat(np.arange(len(self.GEOIDs), dtype=np.int32), np.diff(self.tract_pointers))
+        months, month = np.unique(months_since_epoch(self.day), return_inverse=True)
+
+        monthly = (
+            pd.DataFrame({
+                'tract': tract,
+                'month': month.astype(np.int32),
+                'category': self.category,
+                'count': self.count.astype(np.int64),
+            })
+            .groupby(['tract', 'month', 'category'], sort=True)
+            ['count']
+            .sum()
+        )
+
+        return pd.Series(
+            pd.to_numeric(monthly.values, downcast='unsigned'),
+            index=pd.MultiIndex(
+                levels=[self.GEOIDs, pd.DatetimeIndex(months.astype('datetime64[M]')), self.categories],
+                codes=[monthly.index.get_level_values(level).values for level in ['tract', 'month', 'category']],
+                names=['GEOID', 'Issue Date', 'Violation Type']
+            ),
+            name='tickets count'
+        )
@@ -0,0 +1,70 @@
+# radius and polygon queries over the tract shapes, answered from an STRtree built once per dataset
+# (only the tracts whose bounding boxes touch the query are intersected, never the whole geometry)
+#
+# each matching tract gets a weight: the share of its area inside the query area, so a tract half inside a
+# radius counts for half its tickets and residents (assuming both are spread evenly over the tract)
+# areas and distances are measured in metres, in an equidistant projection centered on the dataset
+
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+from shapely.geometry import shape
+
+# tracts overlapping the query by less than this share of their area are left out
+MIN_OVERLAP_WEIGHT = 0.001
+
+# segments per quarter circle when buffering a radius query
+RADIUS_QUAD_SEGMENTS = 16
+
+
+class TractSpatialIndex:
+
+    def __init__(self, tracts_geometry, center):
+        self.to_metres = pyproj.Transformer.from_crs(
+            'EPSG:4326',
+            f"+proj=aeqd +lat_0={center['lat']} +lon_0={center['lon']} +units=m",
+            always_xy=True
+        )
+
+        features = tracts_geometry['features']
+        self.GEOIDs = pd.Index([feature['properties']['GEOID'] for feature in features], name='GEOID')
+        self.geometries = self.project(
+            np.array([shape(feature['geometry']) for feature in features], dtype=object)
+        )
+        self.areas = shapely.area(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    @property
+    def nbytes(self):
+        # projected coordinates (two float64s each) and areas; the tree itself is small next to them
+        return int(shapely.get_num_coordinates(self.geometries).sum()) * 16 + self.areas.nbytes
+
+    def project(self, geometries):
+        # lon / lat geometries (or an array of them) to metres
+        return shapely.transform(
+            geometries,
+            lambda coordinates: np.column_stack(self.to_metres.transform(coordinates[:, 0], coordinates[:, 1]))
+        )
+
+    def weights(self, query_area):
+        # share of each tract's area inside query_area (already in metres), as a Series indexed by GEOID
+        candidates = self.tree.query(query_area, predicate='intersects')
+        overlap = shapely.area(shapely.intersection(self.geometries[candidates], query_area)) / self.areas[candidates]
+
+        keep = overlap >= MIN_OVERLAP_WEIGHT
+        return pd.Series(np.minimum(overlap[keep], 1), index=self.GEOIDs[candidates[keep]], name='weight')
+
+    def within_radius(self, lon, lat, radius):
+        # tracts within radius metres of a point
+        center = self.project(shapely.Point(lon, lat))
+        return self.weights(center.buffer(radius, quad_segs=RADIUS_QUAD_SEGMENTS))
+
+    def within_polygon(self, geometry):
+        # tracts inside a lon / lat polygon, as geojson geometry or a list of [lon, lat] points
+        if isinstance(geometry, dict):
+            polygon = shape(geometry)
+        else:
+            polygon = shapely.Polygon(geometry)
+        # self-crossing lasso shapes are split into valid parts rather than rejected
+        return self.weights(shapely.make_valid(self.project(polygon)))
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+import result_cache
+from result_cache import RedisResultStore, ResultCache, SQLiteResultStore, decode_array, encode_array
+
+
+class Clock:
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache, 'time', clock)
+    return clock
+
+
+# local stand-in for a redis server: redis-py's get / set, with expiry read from the same clock
+class FakeRedis:
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.values = {}
+
+    def get(self, key):
+        value, expires = self.values.get(key, (None, None))
+        if value is None or expires <= self.clock.time():
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        self.values[key] = (value, self.clock.time() + ex)
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, tmp_path, clock):
+    if request.param == 'sqlite':
+        return SQLiteResultStore(str(tmp_path / 'results.sqlite'), ttl=60)
+    return RedisResultStore(FakeRedis(clock), ttl=60)
+
+
+def test_arrays_round_trip():
+    array = np.array([1.5, np.nan, 3])
+    np.testing.assert_array_equal(decode_array(encode_array(array)), array)
+
+
+def test_store_expires_values_after_ttl(store, clock):
+    store.set('default', b'a')
+    store.set('longer', b'b', ttl=600)
+
+    clock.now += 59
+    assert store.get('default') == b'a'
+
+    clock.now += 2
+    assert store.get('default') is None
+    assert store.get('longer') == b'b'
+
+
+def test_result_cache_computes_once_per_key_and_version(store):
+    calls = []
+    def compute():
+        calls.append(1)
+        return np.arange(3)
+
+    cache = ResultCache(store, 'v1')
+    cache.get_array('map', ['tract', 'Meter'], compute)
+    np.testing.assert_array_equal(cache.get_array('map', ['tract', 'Meter'], compute), np.arange(3))
+    assert len(calls) == 1
+
+    # a new dataset version never reads the old results
+    ResultCache(store, 'v2').get_array('map', ['tract', 'Meter'], compute)
+    assert len(calls) == 2
+
+
+def test_sqlite_evicts_least_recently_used_past_max_bytes(tmp_path, clock):
+    store = SQLiteResultStore(str(tmp_path / 'results.sqlite'), ttl=60, max_bytes=250)
+
+    for key in ['a', 'b']:
+        store.set(key, b'x' * 100)
+        clock.now += 1
+
+    # 'a' is used again, so 'b' is now the least recently used
+    store.get('a')
+    clock.now += 1
+    store.set('c', b'x' * 100)
+
+    assert store.get('a') is not None
+    assert store.get('b') is None
+    assert store.get('c') is not None
+    assert store.total_bytes() == 200
+
+
+def test_sqlite_keeps_running_total_of_sizes(tmp_path, clock):
+    store = SQLiteResultStore(str(tmp_path / 'results.sqlite'), ttl=60)
+
+    store.set('a', b'x' * 10)
+    store.set('b', b'x' * 20)
+    store.set('a', b'x' * 5)   # replaced
+    assert store.total_bytes() == 25
+
+    # expired rows are dropped (and subtracted) on the next write
+    clock.now += 61
+    store.set('c', b'x' * 7)
+    assert store.total_bytes() == 7
+
+    # and a new store on the same file picks the total up
+    assert SQLiteResultStore(store.path).total_bytes() == 7
+
+
+def test_sqlite_batches_last_used_writes(tmp_path, clock):
+    store = SQLiteResultStore(str(tmp_path / 'results.sqlite'), ttl=60)
+    store.set('a', b'x')
+    written_last_used = lambda: store._connect().execute('SELECT last_used FROM results').fetchone()[0]
+    set_at = written_last_used()
+
+    clock.now += 1
+    store.get('a')
+    assert written_last_used() == set_at
+
+    store.flush_touches()
+    assert written_last_used() == set_at + 1
+
+    # written without an explicit flush once enough time has passed
+    clock.now += result_cache.TOUCH_FLUSH_SECONDS
+    store.get('a')
+    assert written_last_used() == clock.now
+
+
+def test_warm_mark_is_shared_per_dataset_version(store):
+    assert not ResultCache(store, 'v1').is_warm()
+
+    ResultCache(store, 'v1').mark_warm()
+    assert ResultCache(store, 'v1').is_warm()
+    assert not ResultCache(store, 'v2').is_warm()
@@ -0,0 +1,116 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from result_cache import SQLiteResultStore
+from tickets_dataset import TicketsDataset, MAP_LEVEL_MIN_ZOOM, read_monthly_tickets
+
+TRACTS = ['36061000100', '36061000200', '36047000100']
+
+
+def square(x, y):
+    return {'type': 'Polygon', 'coordinates': [[[x, y], [x + 0.01, y], [x + 0.01, y + 0.01], [x, y + 0.01], [x, y]]]}
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    pd.DataFrame({
+        'GEOID': TRACTS,
+        'Total population': [1000, 2000, 3000],
+        'White': [500, 500, 500],
+        'Black': [100, 100, 100],
+        'Asian': [100, 100, 100],
+        'Hispanic': [100, 100, 100],
+    }).to_csv(tmp_path / 'tracts.csv', index=False)
+
+    with open(tmp_path / 'geometry.json', 'w') as geometry_file:
+        json.dump({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'GEOID': GEOID}, 'geometry': square(-74 + i * 0.01, 40.7)}
+            for i, GEOID in enumerate(TRACTS)
+        ]}, geometry_file)
+
+    # '36061999900' has tickets but no tract row, in the first and a later month
+    pd.DataFrame(
+        [
+            ['36061000100', '2020-01', 'Meter', 1],
+            ['36061000200', '2020-01', 'Meter', 2],
+            ['36061999900', '2020-01', 'Meter', 50],
+            ['36047000100', '2020-02', 'Meter', 3],
+            ['36061999900', '2020-02', 'Meter', 70],
+            ['36061000100', '2020-03', 'Bus lane', 4],
+            ['36061000200', '2020-03', 'Meter', 5],
+        ],
+        columns=['GEOID', 'year-month', 'category', 'tickets count']
+    ).to_csv(tmp_path / 'monthly.csv', index=False)
+
+    return TicketsDataset(
+        'test',
+        {
+            'tracts': str(tmp_path / 'tracts.csv'),
+            'geometry': str(tmp_path / 'geometry.json'),
+            'monthly_tickets': str(tmp_path / 'monthly.csv'),
+        },
+        SQLiteResultStore(str(tmp_path / 'results.sqlite'))
+    )
+
+
+@pytest.mark.parametrize('map_level', list(MAP_LEVEL_MIN_ZOOM))
+def test_monthly_frames_drop_tickets_of_tracts_without_a_tract_row(dataset, map_level):
+    frames = dataset.monthly_frames(map_level, ['Meter'])
+
+    assert frames.shape == (3, len(dataset.units_by_level[map_level]))
+    # the animation's months add up to the map over the full date range
+    np.testing.assert_array_equal(
+        frames.sum(axis=0),
+        dataset.map_z_vector(map_level, dataset.selected_date_range(None), ['Meter'])
+    )
+
+
+def test_monthly_frames_put_tickets_in_their_month_and_tract(dataset):
+    frames = dataset.monthly_frames('tract', ['Meter'])
+    tract = dataset.units_by_level['tract'].get_loc
+
+    assert frames[0, tract('36061000100')] == 1
+    assert frames[0, tract('36061000200')] == 2
+    assert frames[1, tract('36047000100')] == 3
+    assert frames[2, tract('36061000200')] == 5
+    assert frames.sum() == 11
+
+
+def test_ranking_leaves_out_tracts_without_tickets(dataset):
+    full_date_range = dataset.selected_date_range(None)
+
+    rows = dataset.rank_units('tract', dataset.map_z_vector('tract', full_date_range, ['Bus lane']), 'tickets')
+    assert [row['tickets'] for row in rows] == [4]
+
+    assert dataset.rank_units('tract', dataset.map_z_vector('tract', full_date_range, []), 'per resident') == []
+
+
+def test_monthly_tickets_drop_rows_with_a_blank_key(tmp_path):
+    (tmp_path / 'monthly.csv').write_text(
+        'GEOID,year-month,category,tickets count\n'
+        '36061000100,2020-01,Meter,1\n'
+        ',2020-01,Meter,10\n'
+        '36061000200,,Meter,20\n'
+        '36061000200,2020-02,,30\n'
+        '36061000200,2020-02,Bus lane,2\n'
+    )
+
+    monthly_tickets = read_monthly_tickets(tmp_path / 'monthly.csv')
+
+    assert monthly_tickets.to_dict() == {
+        ('36061000100', pd.Timestamp('2020-01-01'), 'Meter'): 1,
+        ('36061000200', pd.Timestamp('2020-02-01'), 'Bus lane'): 2,
+    }
+
+
+def test_weights_of_a_tract_listed_twice_add_up(dataset):
+    once = dataset.sum_tickets_by_month(['36061000100'], ['Meter', 'Bus lane'], [1.0])
+    twice = dataset.sum_tickets_by_month(['36061000100', '36061000100'], ['Meter', 'Bus lane'], [0.5, 0.5])
+    assert np.allclose(once, twice, equal_nan=True)
+
+    full_date_range = dataset.selected_date_range(None)
+    rows = pd.concat(dataset.export_chunks(full_date_range, ['Meter'], ['36061000200', '36061000200'], [0.25, 0.5]))
+    assert rows['weight'].tolist() == [0.75, 0.75]
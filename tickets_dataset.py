@@ -0,0 +1,549 @@
+# one dataset of tickets by tract: its data, the aggregates and indexes built from it, and the computations
+# the dashboard callbacks run on it
+#
+# configured with a dict of:
+#   'tracts'                  csv of GEOID, Total population, White, Black, Asian, Hispanic
+#   'geometry'                geojson of tract shapes, with GEOID in the properties
+#   'monthly_tickets'         csv of GEOID, year-month, category, tickets count
+#   'fine_tickets'            (optional) csv of GEOID, date, hour, category, tickets count
+#   'neighborhood_crosswalk'  (optional) csv of GEOID, neighborhood
+#   'initial_violation_type'  (optional) violation type shown first
+#   'center'                  (optional) map center, as {'lat': ..., 'lon': ...}
+
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from result_cache import ResultCache
+from sparse_cube import SparseTicketCube
+from spatial_index import TractSpatialIndex
+
+# map level of detail: draw the coarsest level whose minimum zoom is reached
+# (at the default citywide zoom every tract is too small to read anyway)
+MAP_LEVEL_MIN_ZOOM = {
+    'borough': 0,
+    'neighborhood': 9,
+    'tract': 10.5,
+}
+
+# without a neighborhood crosswalk, neighborhoods fall back to groups of tracts sharing a GEOID prefix
+# (county + first two digits of the tract number: 45 groups in NYC, against 2,200 tracts)
+NEIGHBORHOOD_GEOID_PREFIX_LENGTH = 7
+
+# simplification of the merged shapes of each coarse level, in degrees
+# (keeps the neighborhood geojson about 10x, and the borough geojson over 20x, smaller than the tracts')
+SIMPLIFY_TOLERANCE_BY_LEVEL = {
+    'neighborhood': 0.001,
+    'borough': 0.002,
+}
+
+BOROUGH_NAMES = {
+    '36005': 'Bronx',
+    '36047': 'Brooklyn',
+    '36061': 'Manhattan',
+    '36081': 'Queens',
+    '36085': 'Staten Island',
+}
+
+# rows in the ranking table next to the map
+RANKING_TABLE_ROWS = 10
+# areas with fewer residents (parks, airports) are left out of the per-resident ranking
+RANKING_MIN_POPULATION = 100
+
+# rows of the aggregate scanned per chunk when streaming an export
+EXPORT_CHUNK_ROWS = 100_000
+
+DATA_PATH_KEYS = ['tracts', 'geometry', 'monthly_tickets', 'fine_tickets', 'neighborhood_crosswalk']
+
+
+def map_level_for_zoom(zoom):
+    # coarsest level whose minimum zoom has been reached
+    return [level for level, min_zoom in MAP_LEVEL_MIN_ZOOM.items() if zoom >= min_zoom][-1]
+
+
+def normalize_date_range(start, end):
+    # snapped to the months the range fully covers (the data is monthly)
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    start_month = start.to_period('M').to_timestamp()
+    if start_month < start:
+        start_month = start_month + pd.DateOffset(months=1)
+    return [start_month, end.to_period('M').to_timestamp()]
+
+
+def sorted_level(categorical):
+    # sorted level values and codes into them, from a categorical column
+    order = np.argsort(categorical.categories)
+    remap = np.empty(len(order), dtype=categorical.codes.dtype)
+    remap[order] = np.arange(len(order))
+    return categorical.categories[order], remap[categorical.codes]
+
+
+def read_monthly_tickets(path):
+    # read the keys as categoricals, so each GEOID / month / violation type string is parsed and stored once,
+    # and build the index straight from their integer codes, with counts in the smallest unsigned dtype that fits
+    # (avoids the per-row strings and the full-table copies of a rename / set_index / sort_index chain)
+    raw = pd.read_csv(
+        path,
+        usecols=['GEOID','year-month','category','tickets count'],
+        dtype={'GEOID':'category', 'year-month':'category', 'category':'category'}
+    )
+
+    # rows with a blank key would get code -1, which the remap below turns into the last level: drop them
+    keys = ['GEOID','year-month','category']
+    if raw[keys].isna().any(axis=None):
+        raw = raw.dropna(subset=keys)
+        for key in keys:
+            raw[key] = raw[key].cat.remove_unused_categories()
+
+    GEOIDs, GEOID_codes = sorted_level(raw['GEOID'].cat)
+    months, month_codes = sorted_level(raw['year-month'].cat)
+    violations, violation_codes = sorted_level(raw['category'].cat)
+
+    monthly_tickets = pd.Series(
+        pd.to_numeric(raw['tickets count'], downcast='unsigned').values,
+        index=pd.MultiIndex(
+            levels=[GEOIDs.astype(str), pd.to_datetime(months), violations.astype(str)],
+            codes=[GEOID_codes, month_codes, violation_codes],
+            names=['GEOID','Issue Date','Violation Type']
+        ),
+        name='tickets count'
+    )
+
+    # the file is usually already in order, in which case there's nothing to copy
+    if not monthly_tickets.index.is_monotonic_increasing:
+        monthly_tickets = monthly_tickets.sort_index()
+
+    return monthly_tickets
+
+
+def tract_label(GEOID):
+    # readable name of a tract, e.g. 'Manhattan tract 78' or 'Brooklyn tract 1234.01'
+    # (the GEOID's last six digits are the tract number, with two decimals)
+    number = str(int(GEOID[5:9])) + ('' if GEOID[9:] == '00' else f'.{GEOID[9:]}')
+    return f'{BOROUGH_NAMES.get(GEOID[:5], GEOID[:5])} tract {number}'
+
+
+def weights_by_GEOID(selected_GEOIDs, weights):
+    # one weight per tract, as a Series indexed by GEOID (a tract listed more than once counts with its weights summed)
+    return pd.Series(weights, index=selected_GEOIDs, dtype=np.float64).groupby(level=0).sum()
+
+
+def memory_size(structure):
+    if isinstance(structure, (pd.Series, pd.DataFrame, pd.Index)):
+        return int(np.sum(structure.memory_usage(deep=True)))
+    # numpy arrays, the ticket cube and the spatial index
+    if hasattr(structure, 'nbytes'):
+        return structure.nbytes
+    # plotly figures: size as serialized
+    if hasattr(structure, 'to_json'):
+        return len(structure.to_json())
+    # geojson and other plain python structures: size as serialized
+    return len(json.dumps(structure))
+
+
+class TicketsDataset:
+
+    def __init__(self, name, config, result_store):
+        self.name = name
+        self.config = config
+        self.title = config.get('title', name)
+        self.center = config.get('center', {'lat': 40.7, 'lon': -74})
+
+        # identifies the data behind cached results; set DATASET_VERSION on deploy, or it is derived from the data files
+        # (the build that warms the cache and the servers reading it must agree, see the Dockerfile)
+        data_paths = [config[key] for key in DATA_PATH_KEYS if config.get(key) and os.path.exists(config[key])]
+        self.version = os.getenv('DATASET_VERSION') or hashlib.sha1(
+            str([(path, os.path.getsize(path), os.path.getmtime(path)) for path in data_paths]).encode()
+        ).hexdigest()[:12]
+
+        # results shared by all workers (see result_cache.py), kept apart per dataset
+        self.result_cache = ResultCache(result_store, f'{name}-{self.version}')
+
+        self._load()
+        self._build_levels()
+
+        # for radius and polygon selections (see spatial_index.py)
+        self.spatial_index = TractSpatialIndex(self.tracts_geometry, self.center)
+
+        # size of everything above, for the registry's memory budget
+        # (figures built on top of the dataset are added with update_nbytes)
+        self.figures = {}
+        self.update_nbytes()
+
+    def update_nbytes(self):
+        self.nbytes = sum(self.memory_sizes().values())
+
+    #----- load data
+
+    def _load(self):
+        config = self.config
+
+        # indexed by GEOID as read (no set_index copy), with populations in the smallest unsigned dtype that fits
+        self.tracts = (
+            pd.read_csv(
+                config['tracts'],
+                dtype={'GEOID':'str'},
+                index_col='GEOID'
+            )
+            .apply(pd.to_numeric, downcast='unsigned')
+        )
+
+        with open(config['geometry'], 'r') as geojson_file:
+            self.tracts_geometry = json.load(geojson_file)
+        # TODO read this geojson directly into the fontend, without passing it through this laoyout object. not simple to do, though.
+
+        # tract x day x hour x category, stored sparse (see sparse_cube.py)
+        if config.get('fine_tickets') and os.path.exists(config['fine_tickets']):
+            self.ticket_cube = SparseTicketCube.from_csv(config['fine_tickets'])
+            print(f'loaded {len(self.ticket_cube)} day x hour cells ({self.ticket_cube.nbytes / 1e6:.0f} MB)')
+        else:
+            self.ticket_cube = None
+
+        if os.path.exists(config['monthly_tickets']) or self.ticket_cube is None:
+            self.tickets = read_monthly_tickets(config['monthly_tickets'])
+        else:
+            # roll the finer aggregate up to the monthly one the map and timeline use
+            self.tickets = self.ticket_cube.to_monthly_series()
+
+        self.violation_types = self.tickets.index.get_level_values('Violation Type').unique()
+        self.months = self.tickets.index.levels[1]
+        self.initial_violation_type = config.get('initial_violation_type') or self.violation_types[0]
+
+        # x axis for each timeline resolution
+        self.timeline_x = {'month': self.months.values}
+        if self.ticket_cube is not None:
+            self.timeline_x['day'] = self.ticket_cube.rollup('day').index.values
+
+        # total race pcts for citywide bars
+        self.total_race_pct = (
+            (
+                (self.tracts[['White','Black','Asian','Hispanic']].sum())
+                /
+                (self.tracts['Total population'].sum())
+            )
+            .rename('Citywide')
+            .to_frame()
+        )
+
+    #----- build coarser map levels (tract -> neighborhood -> borough)
+
+    def _build_levels(self):
+        tracts = self.tracts
+        tickets = self.tickets
+
+        # borough is the state + county part of the GEOID
+        tract_borough = pd.Series(tracts.index.str[:5], index=tracts.index)
+
+        crosswalk_path = self.config.get('neighborhood_crosswalk')
+        if crosswalk_path and os.path.exists(crosswalk_path):
+            tract_neighborhood = (
+                pd.read_csv(
+                    crosswalk_path,
+                    dtype={'GEOID':'str', 'neighborhood':'str'}
+                )
+                .set_index('GEOID')
+                ['neighborhood']
+                .reindex(tracts.index)
+                # tracts missing from the crosswalk are grouped per borough, under a name that can't be taken
+                # for the borough itself
+                .fillna(tract_borough + ' (unassigned)')
+            )
+        else:
+            tract_neighborhood = pd.Series(tracts.index.str[:NEIGHBORHOOD_GEOID_PREFIX_LENGTH], index=tracts.index)
+
+        self.tract_units_by_level = {
+            'tract': pd.Series(tracts.index, index=tracts.index),
+            'neighborhood': tract_neighborhood,
+            'borough': tract_borough,
+        }
+
+        # precompute tickets summed to each level, indexed like `tickets` so the callbacks can treat every level the same
+        # (units are kept under the 'GEOID' name at every level)
+        self.tickets_by_level = {'tract': tickets}
+        for level in ['neighborhood', 'borough']:
+            self.tickets_by_level[level] = (
+                tickets
+                .groupby([
+                    tickets.index.get_level_values('GEOID').map(self.tract_units_by_level[level]).rename('GEOID'),
+                    'Issue Date',
+                    'Violation Type'
+                ])
+                .sum()
+                .sort_index()
+                .pipe(pd.to_numeric, downcast='unsigned')
+            )
+
+        # units drawn at each level, in map order
+        self.units_by_level = {
+            level: pd.Index(tract_units.unique(), name='GEOID')
+            for level, tract_units in self.tract_units_by_level.items()
+        }
+
+        # residents per unit, in map order, for ranking by tickets per resident
+        self.population_by_level = {
+            level: (
+                tracts['Total population']
+                .groupby(tract_units.values)
+                .sum()
+                .reindex(self.units_by_level[level])
+                .fillna(0)
+                .values
+            )
+            for level, tract_units in self.tract_units_by_level.items()
+        }
+
+        # merge tract shapes into one shape per unit for the coarser levels
+        # (coarse units reuse the 'GEOID' property so the map's featureidkey works at every level)
+        tracts_geodataframe = gpd.GeoDataFrame.from_features(self.tracts_geometry['features'])
+
+        self.geometry_by_level = {'tract': self.tracts_geometry}
+        for level in ['neighborhood', 'borough']:
+            self.geometry_by_level[level] = json.loads(
+                tracts_geodataframe
+                .assign(GEOID=lambda df: df['GEOID'].map(self.tract_units_by_level[level]))
+                .dissolve(by='GEOID')
+                .simplify(SIMPLIFY_TOLERANCE_BY_LEVEL[level])
+                .rename_axis('GEOID')
+                .reset_index(name='geometry')
+                .pipe(gpd.GeoDataFrame)
+                .to_json(drop_id=True)
+            )
+
+        # to expand a selection of any level back to its tracts
+        self.tracts_in_unit = {}
+        for level in ['borough', 'neighborhood', 'tract']:
+            self.tracts_in_unit.update(
+                self.tract_units_by_level[level]
+                .index
+                .to_series()
+                .groupby(self.tract_units_by_level[level].values)
+                .agg(list)
+                .to_dict()
+            )
+
+    def memory_sizes(self):
+        # bytes held by each main structure
+        structures = {
+            'tickets': self.tickets,
+            'tracts': self.tracts,
+            'ticket_cube': self.ticket_cube,
+            'spatial_index': self.spatial_index,
+            **{f"tickets_by_level['{level}']": self.tickets_by_level[level] for level in ['neighborhood', 'borough']},
+            **{f"geometry_by_level['{level}'] (as json)": self.geometry_by_level[level] for level in self.geometry_by_level},
+            **{f"figures['{name}'] (as json)": figure for name, figure in self.figures.items()},
+        }
+        return {name: memory_size(structure) for name, structure in structures.items() if structure is not None}
+
+    #----- computations for the callbacks
+
+    def selected_date_range(self, selected_timeline_area):
+        # date range selected on the timeline, snapped to whole months, or the full range if nothing is selected
+        if selected_timeline_area is None:
+            selected_timeline_area = dict()
+
+        if 'xaxis.range[0]' not in selected_timeline_area:
+            return [self.months.min(), self.months.max()]
+
+        return normalize_date_range(
+            selected_timeline_area['xaxis.range[0]'],
+            selected_timeline_area['xaxis.range[1]']
+        )
+
+    def expand_to_tracts(self, selected_units):
+        # GEOIDs of all tracts in the selected units, whatever level they were selected at
+        return [GEOID for unit in selected_units for GEOID in self.tracts_in_unit.get(unit, [])]
+
+    # tracts in a radius (in metres) or polygon, weighted by the share of their area inside it
+    # (as a Series indexed by GEOID, keeping only tracts with data)
+    def tracts_within_radius(self, lon, lat, radius):
+        tract_weights = self.spatial_index.within_radius(lon, lat, radius)
+        return tract_weights[tract_weights.index.isin(self.tracts.index)]
+
+    def tracts_within_polygon(self, polygon):
+        tract_weights = self.spatial_index.within_polygon(polygon)
+        return tract_weights[tract_weights.index.isin(self.tracts.index)]
+
+    def race_pct(self, selected_GEOIDs, weights=None):
+        # shares of residents in the selected tracts, counting each tract's residents by its weight
+        tracts_selected = self.tracts.loc[selected_GEOIDs]
+        if weights is not None:
+            tracts_selected = tracts_selected.mul(weights, axis=0)
+        return (
+            (tracts_selected[['White','Black','Asian','Hispanic']].sum())
+            /
+            (tracts_selected['Total population'].sum())
+        ).values
+
+    def sum_tickets_by_unit(self, level, selected_dates, selected_violation):
+        # total tickets per map unit at the given level, in map order
+        return (
+            self.tickets_by_level[level]
+            .loc[:,slice(*selected_dates),selected_violation]
+            .groupby('GEOID')
+            .sum()
+            .reindex(self.units_by_level[level])
+            .fillna(0)
+            .astype(int)
+            .reset_index()
+        )
+
+    def sum_tickets_by_month(self, selected_GEOIDs, selected_violation, weights=None):
+        # 3-month rolling mean of monthly tickets for the selected tracts (or all tracts if None), on the timeline's x axis
+        # (reindexed on every month, because the filtered data can include months with no data)
+        # with weights (one per selected tract), each tract's tickets count by its weight
+        selected_tracts = slice(None) if selected_GEOIDs is None else selected_GEOIDs
+        selected_tickets = self.tickets.loc[selected_tracts,:,selected_violation]
+        if weights is not None:
+            selected_tickets = selected_tickets * (
+                weights_by_GEOID(selected_GEOIDs, weights)
+                .reindex(selected_tickets.index.get_level_values('GEOID'))
+                .values
+            )
+        return (
+            selected_tickets
+            .groupby('Issue Date')
+            .sum()
+            .rolling(3,1,center=True).mean()
+            .reindex(self.months)
+            .values
+        )
+
+    def sum_tickets_by_day(self, selected_GEOIDs, selected_violation, weights=None):
+        # 7-day rolling mean of daily tickets from the finer aggregate, on every day it covers
+        return (
+            self.ticket_cube
+            .rollup('day', selected_GEOIDs, selected_violation, weights=weights)
+            .rolling(7,1,center=True).mean()
+            .values
+        )
+
+    def time_breakdown(self, selected_GEOIDs, selected_violation, selected_dates, by, weights=None):
+        # tickets by weekday or hour of day from the finer aggregate, over the whole months in selected_dates
+        return self.ticket_cube.rollup(
+            'weekday' if by == 'weekday' else 'hour',
+            selected_GEOIDs,
+            selected_violation,
+            [selected_dates[0], selected_dates[1] + pd.offsets.MonthEnd(0)],
+            weights=weights
+        )
+
+    # cached versions of the above, as used by the callbacks and the warm-up
+    def map_z_vector(self, map_level, selected_dates, selected_violation, ttl=None):
+        return self.result_cache.get_array(
+            'map',
+            [map_level, selected_dates, sorted(selected_violation)],
+            lambda: self.sum_tickets_by_unit(map_level, selected_dates, selected_violation)['tickets count'].values,
+            ttl=ttl
+        )
+
+    def timeline_y_vector(self, selected_GEOIDs, selected_violation, resolution='month', ttl=None, weights=None):
+        if resolution == 'day':
+            compute = lambda: self.sum_tickets_by_day(selected_GEOIDs, selected_violation, weights)
+        else:
+            compute = lambda: self.sum_tickets_by_month(selected_GEOIDs, selected_violation, weights)
+
+        # weighted selections are keyed on their (rounded) weights as well
+        if selected_GEOIDs is None:
+            selection_key = None
+        elif weights is None:
+            selection_key = sorted(selected_GEOIDs)
+        else:
+            selection_key = sorted(zip(selected_GEOIDs, np.round(weights, 4).tolist()))
+
+        return self.result_cache.get_array(
+            'timeline',
+            [resolution, selection_key, sorted(selected_violation)],
+            compute,
+            ttl=ttl
+        )
+
+    def monthly_frames(self, map_level, selected_violation):
+        # tickets per map unit for every month, in one pass over the level's aggregate:
+        # one row per month (in `months` order), one column per unit (in map order)
+        level_tickets = self.tickets_by_level[map_level]
+        unit_codes, month_codes, violation_codes = level_tickets.index.codes
+        level_units, level_months, level_violations = level_tickets.index.levels
+
+        units = self.units_by_level[map_level]
+
+        # translate the level's codes to map and month positions, and keep the selected violation types
+        # (dropping tickets of tracts that aren't on the map, as the map's own sums do)
+        unit_positions = units.get_indexer(level_units)[unit_codes]
+        month_positions = self.months.get_indexer(level_months)[month_codes]
+        keep = level_violations.isin(selected_violation)[violation_codes]
+        keep &= (unit_positions >= 0) & (month_positions >= 0)
+
+        return np.bincount(
+            month_positions[keep] * len(units) + unit_positions[keep],
+            weights=level_tickets.values[keep],
+            minlength=len(self.months) * len(units)
+        ).reshape(len(self.months), len(units))
+
+    def rank_units(self, map_level, selected_tickets, ranking_metric):
+        # table rows for the units with the most tickets (or tickets per 1,000 residents), from the map's z-vector
+        # (argpartition picks the top rows without sorting every unit; only those few rows are sorted)
+        population = self.population_by_level[map_level]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tickets_per_1000 = np.where(population >= RANKING_MIN_POPULATION, selected_tickets / population * 1000, 0)
+
+        ranked_values = tickets_per_1000 if ranking_metric == 'per resident' else selected_tickets
+
+        # only units with any tickets (none at all, e.g. with no violation types selected, leaves the table empty)
+        candidates = np.flatnonzero(ranked_values > 0)
+        n = min(RANKING_TABLE_ROWS, len(candidates))
+        if n == 0:
+            return []
+        top = candidates[np.argpartition(ranked_values[candidates], -n)[-n:]]
+        top = top[np.argsort(ranked_values[top])[::-1]]
+
+        units = self.units_by_level[map_level]
+        return [
+            {
+                'rank': rank + 1,
+                'area': tract_label(units[position]) if map_level == 'tract' else BOROUGH_NAMES.get(units[position], units[position]),
+                'tickets': int(selected_tickets[position]),
+                'tickets per 1,000 residents': round(float(tickets_per_1000[position]), 1),
+            }
+            for rank, position in enumerate(top)
+        ]
+
+    def export_chunks(self, selected_dates, selected_violation, selected_GEOIDs, weights=None):
+        # matching rows as small DataFrames, filtered on the index codes of each slice of `tickets`,
+        # so exporting the whole history never holds a second copy of it in memory
+        # (with weights, one per selected tract, each row also gets its tract's weight)
+        tickets = self.tickets
+        GEOID_codes, date_codes, violation_codes = tickets.index.codes
+        GEOIDs, dates, violations = tickets.index.levels
+
+        # which level values are wanted, indexed by code
+        wanted_dates = (dates >= selected_dates[0]) & (dates <= selected_dates[1])
+        wanted_violations = violations.isin(selected_violation)
+        wanted_GEOIDs = None if selected_GEOIDs is None else GEOIDs.isin(selected_GEOIDs)
+        if weights is not None:
+            GEOID_weights = weights_by_GEOID(selected_GEOIDs, weights).reindex(GEOIDs).values
+
+        for start in range(0, len(tickets), EXPORT_CHUNK_ROWS):
+            chunk = slice(start, start + EXPORT_CHUNK_ROWS)
+
+            keep = wanted_dates[date_codes[chunk]] & wanted_violations[violation_codes[chunk]]
+            if wanted_GEOIDs is not None:
+                keep &= wanted_GEOIDs[GEOID_codes[chunk]]
+
+            if not keep.any():
+                continue
+
+            rows = np.flatnonzero(keep) + start
+            rows_frame = pd.DataFrame({
+                'GEOID': GEOIDs[GEOID_codes[rows]],
+                'year-month': dates[date_codes[rows]],
+                'category': violations[violation_codes[rows]],
+                'tickets count': tickets.values[rows],
+            })
+            if weights is not None:
+                rows_frame['weight'] = GEOID_weights[GEOID_codes[rows]]
+            yield rows_frame